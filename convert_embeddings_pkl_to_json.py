@@ -17,6 +17,8 @@ Options:
   --max-items N    Limite du nombre d'items (debug)
   --sort           Trie par identifiant
   --pretty         JSON indenté (plus gros)
+  --int8           Quantification int8 symétrique (implique normalisation L2)
+  --binary         Signe seul, 1 bit/dimension via packbits (encore plus compact)
   --schema         Affiche le schéma JSON attendu et quitte
 
 Schéma JSON produit:
@@ -25,19 +27,68 @@ Schéma JSON produit:
   "dimension": 512,
   "embeddings": [
      {"id": "alice", "vector": [0.1234, ...]},
-     {"id": "bob",   "vector": [...]} 
+     {"id": "bob",   "vector": [...]}
   ]
 }
+
+Schéma quantifié (--int8): chaque vecteur est normalisé L2 puis quantifié
+q = clip(round(x * 127.5), -127, 127), stocké en base64 (int8 little-endian).
+Déquantification côté client: x = q / 127.5.
+{
+  "version": 1,
+  "dimension": 512,
+  "quantization": {"dtype": "int8", "scale": 127.5},
+  "embeddings": [
+     {"id": "alice", "q": "<base64>"}
+  ]
+}
+Avec --binary, seul le signe est conservé (1 bit/dim via packbits):
+"quantization": {"dtype": "binary", "bits_per_dim": 1}.
 """
 from __future__ import annotations
-import argparse, json, pickle, os, sys, math
+import argparse, base64, json, os, sys, math
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Iterable
 
+try:
+    import _pickle as pickle  # implémentation C, sans le wrapper Python de `pickle`
+except ImportError:
+    import pickle  # type: ignore
+
 try:
     import numpy as np  # facultatif
 except ImportError:
     np = None  # type: ignore
 
+try:
+    import orjson  # facultatif: encodeur JSON en C, bien plus rapide pour les gros exports
+except ImportError:
+    orjson = None  # type: ignore
+
+# numba (facultatif): JIT du chemin par vecteur, utile quand un pickle aux
+# dimensions hétérogènes empêche le traitement par lots
+if np is not None:
+    try:
+        from numba import njit
+
+        @njit(cache=True, fastmath=True)
+        def _l2_normalize_1d(a):
+            # a: float32 1-D contigu (on garantit le 1-D côté appelant pour
+            # éviter les erreurs de typage ascontiguousarray de numba)
+            n = 0.0
+            for i in range(a.shape[0]):
+                n += a[i] * a[i]
+            n = math.sqrt(n)
+            if n < 1e-12:
+                return a
+            for i in range(a.shape[0]):
+                a[i] /= n
+            return a
+    except ImportError:
+        _l2_normalize_1d = None
+else:
+    _l2_normalize_1d = None
+
 def detect_dimension(vec: Iterable[float]) -> int:
     try:
         return len(list(vec))
@@ -45,17 +96,83 @@ def detect_dimension(vec: Iterable[float]) -> int:
         return -1
 
 def normalize_vector(v: Iterable[float], eps: float = 1e-12) -> list[float]:
+    if np is not None:
+        # Chemin vectorisé: un seul noyau SIMD au lieu d'une boucle Python par composante
+        a = np.ascontiguousarray(np.asarray(list(v), dtype=np.float32))
+        if _l2_normalize_1d is not None:
+            return _l2_normalize_1d(a).tolist()
+        n = float(np.sqrt(np.dot(a, a)))
+        if n < eps:
+            return a.tolist()
+        return (a * (1.0 / n)).tolist()
     arr = list(float(x) for x in v)
     norm = math.sqrt(sum(x*x for x in arr))
     if norm < eps:
         return arr
     return [x / norm for x in arr]
 
+def _normalize_rows_inplace(c, eps: float = 1e-12) -> None:
+    norms = np.linalg.norm(c, axis=1, keepdims=True)
+    np.divide(c, np.maximum(norms, eps), out=c)
+
+def normalize_matrix(mat, eps: float = 1e-12) -> None:
+    """Normalisation L2 in-place des lignes de mat, parallélisée sur les gros lots."""
+    ncpu = os.cpu_count() or 1
+    if mat.shape[0] >= 8192 and ncpu > 1:
+        # Chaque chunk écrit des lignes disjointes (pas de verrou nécessaire) et
+        # np.linalg.norm relâche le GIL -> gain quasi linéaire en nombre de coeurs
+        chunks = np.array_split(mat, ncpu)
+        with ThreadPoolExecutor(max_workers=ncpu) as ex:
+            list(ex.map(_normalize_rows_inplace, chunks))
+        return
+    _normalize_rows_inplace(mat, eps)
+
+
 def round_vector(v: Iterable[float], precision: int) -> list[float]:
     factor = 10 ** precision
+    if np is not None:
+        # float64 pour que le repr JSON reste court après arrondi
+        a = np.asarray(list(v), dtype=np.float64)
+        return (np.round(a * factor) / factor).tolist()
     return [math.floor(x * factor + 0.5) / factor for x in v]
 
+CHUNK_ROWS = 1024
+
+def iter_chunked_records(items, mat, args):
+    """Normalise + arrondit/quantifie + émet par chunks de CHUNK_ROWS lignes.
+
+    Fusionne les passes pendant que le chunk est encore chaud en cache L2:
+    une seule traversée mémoire de mat au lieu de trois, et le pic RSS reste
+    à ~1x mat + un chunk.
+    """
+    factor = 10.0 ** args.precision
+    for start in range(0, mat.shape[0], CHUNK_ROWS):
+        c = mat[start:start + CHUNK_ROWS].copy()
+        if args.normalize or args.int8 or args.binary:
+            _normalize_rows_inplace(c)
+        if args.int8:
+            q = np.clip(np.round(c * 127.5), -127, 127).astype(np.int8)
+            for j in range(q.shape[0]):
+                yield {"id": items[start + j]['id'], "q": base64.b64encode(q[j].tobytes()).decode('ascii')}
+        elif args.binary:
+            bits = np.packbits(c >= 0, axis=1)
+            for j in range(bits.shape[0]):
+                yield {"id": items[start + j]['id'], "q": base64.b64encode(bits[j].tobytes()).decode('ascii')}
+        else:
+            c = c.astype(np.float64)
+            np.multiply(c, factor, out=c)
+            np.round(c, out=c)
+            np.divide(c, factor, out=c)
+            for j in range(c.shape[0]):
+                yield {"id": items[start + j]['id'], "vector": c[j] if orjson is not None else c[j].tolist()}
+
 def extract_items(obj: Any) -> list[dict]:
+    # Chemin rapide: dict homogène {str: np.ndarray} (forme typique produite par
+    # les pipelines d'embeddings) -> une seule vérification de schéma, pas de
+    # cascade d'isinstance par élément
+    if (np is not None and isinstance(obj, dict) and obj
+            and all(isinstance(v, np.ndarray) for v in obj.values())):
+        return [{"id": str(k), "vector": v} for k, v in obj.items()]
     items = []
     # Case dict
     if isinstance(obj, dict):
@@ -90,9 +207,14 @@ def extract_items(obj: Any) -> list[dict]:
         raise ValueError("Structure pickle non supportée directement.")
     return items
 
-def coerce_vector(v: Any) -> list[float]:
-    if np is not None and isinstance(v, np.ndarray):
-        return v.astype('float32').tolist()
+def coerce_vector(v: Any):
+    if np is not None:
+        # np.asarray passe par le protocole buffer C et couvre ndarray, list et
+        # tuple sans payer un appel float() Python par composante
+        try:
+            return np.asarray(v, dtype=np.float32)
+        except (TypeError, ValueError):
+            raise ValueError("Format de vecteur non supporté")
     if isinstance(v, (list, tuple)):
         return [float(x) for x in v]
     raise ValueError("Format de vecteur non supporté")
@@ -105,7 +227,10 @@ def main():
     ap.add_argument('--max-items', type=int, default=None, help='Limiter nombre items')
     ap.add_argument('--sort', action='store_true', help='Trie par id')
     ap.add_argument('--pretty', action='store_true', help='Indentation JSON')
+    ap.add_argument('--stream', action='store_true', help='Écriture incrémentale (mémoire O(D), ignore --pretty)')
     ap.add_argument('--normalize', action='store_true', help='Applique normalisation L2 avant arrondi')
+    ap.add_argument('--int8', action='store_true', help='Quantification int8 symétrique en base64 (implique --normalize)')
+    ap.add_argument('--binary', action='store_true', help='Signe seul, 1 bit/dimension (implique --normalize)')
     ap.add_argument('--schema', action='store_true', help='Affiche le schéma JSON et quitte')
     args = ap.parse_args()
 
@@ -121,7 +246,9 @@ def main():
         print(f"[ERREUR] Fichier introuvable: {args.input}", file=sys.stderr)
         sys.exit(1)
 
-    with open(args.input, 'rb') as f:
+    # Tampon de 1 Mio: les gros pickles se lisent en quelques syscalls au lieu
+    # de milliers de petits read()
+    with open(args.input, 'rb', buffering=1 << 20) as f:
         try:
             data = pickle.load(f)
         except Exception as e:
@@ -139,29 +266,102 @@ def main():
     if args.max_items:
         items = items[:args.max_items]
 
-    processed = []
     dimension = None
-    for it in items:
-        vec = coerce_vector(it['vector'])
-        if args.normalize:
-            vec = normalize_vector(vec)
-        vec = round_vector(vec, args.precision)
-        if dimension is None:
-            dimension = detect_dimension(vec)
-        processed.append({"id": it['id'], "vector": vec})
-
-    out_obj = {
+    mat = None
+    if np is not None:
+        # Traitement par lots: une seule matrice (N, D) float32 au lieu de N petits
+        # vecteurs -> un passage mémoire par étape, noyaux SIMD sur tout le lot
+        try:
+            mat = np.stack([np.asarray(it['vector'], dtype=np.float32) for it in items])
+        except (TypeError, ValueError):
+            mat = None  # dimensions hétérogènes: retour au chemin par vecteur
+
+    if (args.int8 or args.binary) and mat is None:
+        print("[ERREUR] --int8/--binary nécessitent numpy et des vecteurs de dimension homogène.", file=sys.stderr)
+        sys.exit(4)
+
+    quantization = None
+    if mat is not None:
+        dimension = int(mat.shape[1])
+        if args.int8:
+            # Quantification symétrique: x ≈ q/127.5 -> 1 octet/dim au lieu de ~8 en ASCII
+            quantization = {"dtype": "int8", "scale": 127.5}
+        elif args.binary:
+            # 1 bit/dimension: seul le signe est conservé (similarité de Hamming côté client)
+            quantization = {"dtype": "binary", "bits_per_dim": 1}
+        if args.stream:
+            # Passes fusionnées par chunks: mat n'est traversée qu'une seule fois
+            records = iter_chunked_records(items, mat, args)
+        elif args.int8:
+            normalize_matrix(mat)
+            q = np.clip(np.round(mat * 127.5), -127, 127).astype(np.int8)
+            records = ({"id": it['id'], "q": base64.b64encode(q[i].tobytes()).decode('ascii')}
+                       for i, it in enumerate(items))
+        elif args.binary:
+            normalize_matrix(mat)
+            bits = np.packbits(mat >= 0, axis=1)
+            records = ({"id": it['id'], "q": base64.b64encode(bits[i].tobytes()).decode('ascii')}
+                       for i, it in enumerate(items))
+        else:
+            if args.normalize:
+                normalize_matrix(mat)
+            factor = 10.0 ** args.precision
+            # float64 pour que le repr JSON reste court après arrondi; puis un
+            # seul passage in-place (pas de temporaires multiplier/arrondir/diviser)
+            mat = mat.astype(np.float64)
+            np.multiply(mat, factor, out=mat)
+            np.round(mat, out=mat)
+            np.divide(mat, factor, out=mat)
+            # orjson sérialise les ndarray directement (OPT_SERIALIZE_NUMPY),
+            # inutile de payer un .tolist() dans ce cas
+            records = ({"id": it['id'], "vector": mat[i] if orjson is not None else mat[i].tolist()}
+                       for i, it in enumerate(items))
+    else:
+        def _iter_scalar():
+            for it in items:
+                vec = coerce_vector(it['vector'])
+                if args.normalize:
+                    vec = normalize_vector(vec)
+                yield {"id": it['id'], "vector": round_vector(vec, args.precision)}
+        dimension = detect_dimension(coerce_vector(items[0]['vector']))
+        records = _iter_scalar()
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    meta = {
         "version": 1,
         "dimension": dimension if dimension is not None else 0,
-        "count": len(processed),
-        "embeddings": processed
+        "count": len(items),
     }
+    if quantization is not None:
+        meta["quantization"] = quantization
 
-    os.makedirs(os.path.dirname(args.output), exist_ok=True)
-    with open(args.output, 'w', encoding='utf-8') as f:
-        json.dump(out_obj, f, ensure_ascii=False, indent=2 if args.pretty else None)
+    if args.stream:
+        # Écriture incrémentale: on garde O(D) d'objets Python vivants au lieu de
+        # matérialiser les N enregistrements avant sérialisation (--pretty ignoré)
+        if orjson is not None:
+            _dumps = lambda o: orjson.dumps(o, option=orjson.OPT_SERIALIZE_NUMPY)
+        else:
+            _dumps = lambda o: json.dumps(o, ensure_ascii=False).encode('utf-8')
+        with open(args.output, 'wb') as f:
+            f.write(_dumps(meta)[:-1])  # objet meta sans le '}' final
+            f.write(b',"embeddings":[')
+            for i, rec in enumerate(records):
+                if i:
+                    f.write(b',')
+                f.write(_dumps(rec))
+            f.write(b']}')
+    else:
+        out_obj = dict(meta)
+        out_obj["embeddings"] = list(records)
+        if orjson is not None:
+            opt = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if args.pretty else 0)
+            with open(args.output, 'wb') as f:
+                f.write(orjson.dumps(out_obj, option=opt))
+        else:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(out_obj, f, ensure_ascii=False, indent=2 if args.pretty else None)
 
-    print(f"[OK] Export JSON: {args.output} | items={len(processed)} dimension={dimension}")
+    print(f"[OK] Export JSON: {args.output} | items={len(items)} dimension={dimension}")
 
 if __name__ == '__main__':
     main()
@@ -1,57 +1,91 @@
 """
 Script pour convertir face_model.pkl (embeddings) en modèle ONNX
-1) Entraîne un classificateur scikit-learn (MLPClassifier) sur les embeddings
+1) Entraîne un classificateur scikit-learn sur les embeddings
+   (régression logistique par défaut, MLP via --mlp)
 2) Convertit le modèle vers ONNX via skl2onnx (compatible Python 3.13)
 """
+import argparse
+import hashlib
 import os
 import pickle
+import joblib
 import numpy as np
+from sklearn.linear_model import LogisticRegression
 from sklearn.neural_network import MLPClassifier
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 from sklearn.model_selection import train_test_split
 from sklearn.pipeline import Pipeline
 from skl2onnx import convert_sklearn
 from skl2onnx.common.data_types import FloatTensorType
+import onnx
+from onnx import TensorProto, helper, numpy_helper
 import json
 
 ASSETS_DIR = 'android/app/src/main/assets'
 ONNX_PATH = os.path.join(ASSETS_DIR, 'face_recognition_model.onnx')
 METADATA_PATH = os.path.join(ASSETS_DIR, 'face_recognition_metadata.json')
 PKL_PATH = 'face_model.pkl'
+NPZ_CACHE_PATH = 'face_model.npz'
 
 
 def load_embeddings(pkl_path: str):
+    # Cache .npz: évite de re-parser le pickle et la boucle de conversion Python
+    # à chaque run (utile en itération de dev)
+    if os.path.exists(NPZ_CACHE_PATH) and os.path.getmtime(NPZ_CACHE_PATH) >= os.path.getmtime(pkl_path):
+        print(f"📂 Chargement du cache {NPZ_CACHE_PATH}...")
+        z = np.load(NPZ_CACHE_PATH, allow_pickle=True)
+        embeddings, labels = z['embeddings'], z['labels']
+        print(f"✓ {len(embeddings)} embeddings | dims={embeddings.shape[1]}")
+        return embeddings, labels
     print(f"📂 Chargement des embeddings depuis {pkl_path}...")
     with open(pkl_path, 'rb') as f:
         data = pickle.load(f)
-    embeddings, labels = [], []
-    for item in data:
-        embeddings.append(np.array(item['embedding'], dtype=np.float32))
-        labels.append(item['label'])
-    embeddings = np.array(embeddings, dtype=np.float32)
-    labels = np.array(labels)
+    # Préallocation (N, D): une seule matrice remplie ligne à ligne, au lieu de
+    # N petits ndarray recopiés ensuite dans la matrice finale
+    dim = len(data[0]['embedding'])
+    embeddings = np.empty((len(data), dim), dtype=np.float32)
+    labels = np.empty(len(data), dtype=object)
+    for i, item in enumerate(data):
+        embeddings[i] = item['embedding']
+        labels[i] = item['label']
     print(f"✓ {len(embeddings)} embeddings | dims={embeddings.shape[1]}")
     print(f"✓ Personnes: {np.unique(labels)}")
+    np.savez(NPZ_CACHE_PATH, embeddings=embeddings, labels=labels)
+    print(f"✓ Cache écrit: {NPZ_CACHE_PATH}")
     return embeddings, labels
 
 
-def create_classifier_model(input_dim: int, num_classes: int):
-    print("\n🔨 Création du modèle classificateur scikit-learn (MLP)...")
-    # Pipeline: StandardScaler + MLPClassifier
+def create_classifier_model(input_dim: int, num_classes: int, use_mlp: bool = False,
+                            verbose: bool = False):
+    if use_mlp:
+        # Repli MLP pour des embeddings non linéairement séparables
+        print("\n🔨 Création du modèle classificateur scikit-learn (MLP)...")
+        model = Pipeline([
+            ('scaler', StandardScaler()),
+            ('clf', MLPClassifier(
+                hidden_layer_sizes=(256, 128, 64),
+                activation='relu',
+                solver='adam',
+                max_iter=200,
+                early_stopping=True,
+                validation_fraction=0.1,
+                random_state=42,
+                # l'affichage par itération sérialise sur le verrou console
+                # (sensible sous Windows), on ne l'active que sur demande
+                verbose=verbose
+            ))
+        ])
+        print(f"✓ Pipeline créé: StandardScaler → MLP(256→128→64→{num_classes})")
+        return model
+    # Les embeddings 512-d normalisés L2 sont quasi linéairement séparables:
+    # un modèle linéaire atteint une précision comparable au MLP pour un
+    # entraînement ~100x plus rapide et un ONNX bien plus petit
+    print("\n🔨 Création du modèle classificateur scikit-learn (régression logistique)...")
     model = Pipeline([
         ('scaler', StandardScaler()),
-        ('mlp', MLPClassifier(
-            hidden_layer_sizes=(256, 128, 64),
-            activation='relu',
-            solver='adam',
-            max_iter=200,
-            early_stopping=True,
-            validation_fraction=0.1,
-            random_state=42,
-            verbose=True
-        ))
+        ('clf', LogisticRegression(C=10, max_iter=1000, n_jobs=-1))
     ])
-    print(f"✓ Pipeline créé: StandardScaler → MLP(256→128→64→{num_classes})")
+    print(f"✓ Pipeline créé: StandardScaler → LogisticRegression({num_classes} classes)")
     return model
 
 
@@ -63,16 +97,57 @@ def train_model(model, X_train, y_train, X_val, y_val):
     return model
 
 
-def save_metadata(labels, input_dim: int):
+def compute_cosine_centroids(embeddings, labels):
+    """Centroïdes L2-normalisés par classe.
+
+    La reconnaissance se réduit alors à « centroïde le plus proche en cosinus »:
+    un seul Gemm + ArgMax, sans aucun entraînement.
+    """
+    emb = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    unique_labels = sorted(np.unique(labels))
+    centroids = np.stack([emb[labels == name].mean(axis=0) for name in unique_labels])
+    centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32), unique_labels
+
+
+def convert_centroids_to_onnx(centroids, sample_input_dim: int):
+    print("\n🔄 Export ONNX du classificateur par centroïdes (Gemm + ArgMax)...")
+    num_classes = centroids.shape[0]
+    x = helper.make_tensor_value_info('float_input', TensorProto.FLOAT, [None, sample_input_dim])
+    scores = helper.make_tensor_value_info('scores', TensorProto.FLOAT, [None, num_classes])
+    label = helper.make_tensor_value_info('label', TensorProto.INT64, [None, 1])
+    graph = helper.make_graph(
+        [
+            helper.make_node('Gemm', ['float_input', 'C'], ['scores'], transB=1),
+            helper.make_node('ArgMax', ['scores'], ['label'], axis=1),
+        ],
+        'face_cosine_centroid_classifier',
+        [x], [scores, label],
+        initializer=[numpy_helper.from_array(centroids, 'C')],
+    )
+    onnx_model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    onnx.checker.check_model(onnx_model)
+
+    with open(ONNX_PATH, 'wb') as f:
+        f.write(onnx_model.SerializeToString())
+
+    print(f"✓ Modèle ONNX sauvegardé: {ONNX_PATH}")
+    print(f"   Taille: {os.path.getsize(ONNX_PATH) / 1024:.2f} KB")
+
+
+def save_metadata(labels, input_dim: int, centroids=None):
     os.makedirs(ASSETS_DIR, exist_ok=True)
     unique_labels = sorted(np.unique(labels))
     metadata = {
         'names': list(unique_labels),
         'num_classes': len(unique_labels),
         'input_shape': [input_dim],
-        'model_type': 'EmbeddingClassifier',
+        'model_type': 'CosineCentroid' if centroids is not None else 'EmbeddingClassifier',
         'format': 'onnx'
     }
+    if centroids is not None:
+        # Copie des centroïdes côté client: permet un repli sans ONNX Runtime
+        metadata['centroids'] = centroids.tolist()
     with open(METADATA_PATH, 'w', encoding='utf-8') as f:
         json.dump(metadata, f, indent=2, ensure_ascii=False)
     print(f"✓ Métadonnées sauvegardées: {METADATA_PATH}")
@@ -98,7 +173,70 @@ def convert_to_onnx(model, sample_input_dim: int):
     print(f"   Taille: {os.path.getsize(ONNX_PATH) / 1024:.2f} KB")
 
 
+def convert_to_onnx_fast(model, sample_input_dim: int):
+    """Export ONNX direct (Gemm + Softmax) pour le pipeline linéaire, sans skl2onnx.
+
+    Le StandardScaler est fusionné dans le Gemm: W' = W/σ, b' = b - W'·μ,
+    donc l'inférence Android se réduit à un seul MatMul fusionné.
+    """
+    print("\n🔄 Export ONNX direct (Gemm + Softmax)...")
+    scaler = model.named_steps['scaler']
+    clf = model.named_steps['clf']
+
+    W = clf.coef_.astype(np.float32)
+    b = clf.intercept_.astype(np.float32)
+    if W.shape[0] == 1:
+        # Cas binaire: sklearn ne stocke qu'une ligne (logit sigmoïde de la
+        # classe 1); un Softmax sur ce seul logit renverrait 1.0 constant.
+        # On étend en deux lignes ±W/2: softmax([-z/2, z/2]) = [1-σ(z), σ(z)],
+        # exactement predict_proba (le facteur 1/2 compense le fait que
+        # softmax sur [-z, z] donnerait σ(2z))
+        W = np.vstack([-W, W]) * np.float32(0.5)
+        b = np.concatenate([-b, b]) * np.float32(0.5)
+    sigma = scaler.scale_.astype(np.float32)
+    mu = scaler.mean_.astype(np.float32)
+    W_fused = W / sigma
+    b_fused = b - W_fused @ mu
+
+    num_classes = W.shape[0]
+    x = helper.make_tensor_value_info('float_input', TensorProto.FLOAT, [None, sample_input_dim])
+    y = helper.make_tensor_value_info('probabilities', TensorProto.FLOAT, [None, num_classes])
+    graph = helper.make_graph(
+        [
+            helper.make_node('Gemm', ['float_input', 'W', 'b'], ['logits'], transB=1),
+            helper.make_node('Softmax', ['logits'], ['probabilities'], axis=1),
+        ],
+        'face_embedding_classifier',
+        [x], [y],
+        initializer=[
+            numpy_helper.from_array(W_fused, 'W'),
+            numpy_helper.from_array(b_fused, 'b'),
+        ],
+    )
+    onnx_model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    onnx.checker.check_model(onnx_model)
+
+    with open(ONNX_PATH, 'wb') as f:
+        f.write(onnx_model.SerializeToString())
+
+    print(f"✓ Modèle ONNX sauvegardé: {ONNX_PATH}")
+    print(f"   Taille: {os.path.getsize(ONNX_PATH) / 1024:.2f} KB")
+
+
 def main():
+    ap = argparse.ArgumentParser(description="Convertit face_model.pkl en modèle ONNX")
+    ap.add_argument('--mlp', action='store_true',
+                    help='Utilise le MLP historique au lieu du classificateur linéaire')
+    ap.add_argument('--no-cache', action='store_true',
+                    help='Force le ré-entraînement même si un classificateur en cache existe')
+    ap.add_argument('--fast-export', action='store_true',
+                    help='Export ONNX direct Gemm+Softmax (classificateur linéaire uniquement)')
+    ap.add_argument('--cosine-centroid', action='store_true',
+                    help='Saute tout entraînement: export des centroïdes cosinus par classe')
+    ap.add_argument('--verbose', action='store_true',
+                    help='Affiche la perte par itération pendant l\'entraînement')
+    args = ap.parse_args()
+
     print("="*70)
     print("🤖 CONVERSION DE VOTRE MODÈLE VERS ONNX")
     print("="*70)
@@ -107,19 +245,48 @@ def main():
         return
 
     embeddings, labels = load_embeddings(PKL_PATH)
+
+    if args.cosine_centroid:
+        # Pas d'entraînement: le « modèle » n'est que la matrice des centroïdes
+        centroids, _ = compute_cosine_centroids(embeddings, labels)
+        os.makedirs(ASSETS_DIR, exist_ok=True)
+        convert_centroids_to_onnx(centroids, embeddings.shape[1])
+        save_metadata(labels, embeddings.shape[1], centroids=centroids)
+        print("\n✅ Conversion ONNX terminée.")
+        print(f"📦 Fichiers: \n  - {ONNX_PATH}\n  - {METADATA_PATH}")
+        return
+
     label_encoder = LabelEncoder()
     labels_encoded = label_encoder.fit_transform(labels)
     num_classes = len(label_encoder.classes_)
 
-    X_train, X_val, y_train, y_val = train_test_split(
-        embeddings, labels_encoded, test_size=0.2, random_state=42, stratify=labels_encoded
-    )
+    # Cache du classificateur entraîné, indexé par le contenu du pickle:
+    # si face_model.pkl n'a pas changé, on saute l'entraînement complet
+    h = hashlib.sha256(open(PKL_PATH, 'rb').read()).hexdigest()[:16]
+    clf_kind = 'mlp' if args.mlp else 'lr'
+    cache_path = f'face_model.clf.{clf_kind}.{h}.joblib'
+
+    if not args.no_cache and os.path.exists(cache_path):
+        print(f"📂 Classificateur en cache: {cache_path} (entraînement sauté)")
+        model = joblib.load(cache_path)
+    else:
+        X_train, X_val, y_train, y_val = train_test_split(
+            embeddings, labels_encoded, test_size=0.2, random_state=42, stratify=labels_encoded
+        )
 
-    model = create_classifier_model(embeddings.shape[1], num_classes)
-    model = train_model(model, X_train, y_train, X_val, y_val)
+        model = create_classifier_model(embeddings.shape[1], num_classes,
+                                        use_mlp=args.mlp, verbose=args.verbose)
+        model = train_model(model, X_train, y_train, X_val, y_val)
+        joblib.dump(model, cache_path, compress=3)
+        print(f"✓ Classificateur mis en cache: {cache_path}")
 
     os.makedirs(ASSETS_DIR, exist_ok=True)
-    convert_to_onnx(model, embeddings.shape[1])
+    if args.fast_export and not args.mlp:
+        convert_to_onnx_fast(model, embeddings.shape[1])
+    else:
+        if args.fast_export:
+            print("⚠ --fast-export ignoré: uniquement disponible pour le classificateur linéaire")
+        convert_to_onnx(model, embeddings.shape[1])
     save_metadata(labels, embeddings.shape[1])
 
     print("\n✅ Conversion ONNX terminée.")
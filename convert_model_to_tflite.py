@@ -1,8 +1,11 @@
 """
 Script pour convertir face_model.pkl (embeddings) en modèle TensorFlow Lite
 Entraîne un classificateur sur les embeddings existants
+(ou exporte des centroïdes cosinus sans entraînement via --cosine-centroid)
 """
+import argparse
 import pickle
+import sys
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
@@ -11,30 +14,65 @@ from sklearn.model_selection import train_test_split
 import json
 import os
 
+NPZ_CACHE_PATH = 'face_model.npz'
+
 def load_embeddings(pkl_path):
-    """Charge les embeddings depuis le fichier pickle"""
+    """Charge les embeddings depuis le fichier pickle (avec cache .npz)"""
+    # Cache .npz: évite de re-parser le pickle et la boucle de conversion Python
+    # à chaque run (utile en itération de dev)
+    if os.path.exists(NPZ_CACHE_PATH) and os.path.getmtime(NPZ_CACHE_PATH) >= os.path.getmtime(pkl_path):
+        print(f"📂 Chargement du cache {NPZ_CACHE_PATH}...")
+        z = np.load(NPZ_CACHE_PATH, allow_pickle=True)
+        embeddings, labels = z['embeddings'], z['labels']
+        print(f"✓ {len(embeddings)} embeddings chargés (cache)")
+        return embeddings, labels
+
     print(f"📂 Chargement des embeddings depuis {pkl_path}...")
     with open(pkl_path, 'rb') as f:
         data = pickle.load(f)
     
-    # Extraire les embeddings et labels
-    embeddings = []
-    labels = []
-    
-    for item in data:
-        embeddings.append(np.array(item['embedding']))
-        labels.append(item['label'])
-    
-    embeddings = np.array(embeddings)
-    labels = np.array(labels)
+    # Extraire les embeddings et labels dans une matrice préallouée (N, D):
+    # évite N petits ndarray recopiés ensuite dans la matrice finale
+    dim = len(data[0]['embedding'])
+    embeddings = np.empty((len(data), dim), dtype=np.float32)
+    labels = np.empty(len(data), dtype=object)
+    for i, item in enumerate(data):
+        embeddings[i] = item['embedding']
+        labels[i] = item['label']
     
+    unique_labels = np.unique(labels)
     print(f"✓ {len(embeddings)} embeddings chargés")
     print(f"✓ Dimension des embeddings: {embeddings.shape[1]}")
-    print(f"✓ Personnes: {np.unique(labels)}")
-    print(f"✓ Nombre de personnes: {len(np.unique(labels))}")
-    
+    print(f"✓ Personnes: {unique_labels}")
+    print(f"✓ Nombre de personnes: {len(unique_labels)}")
+
+    np.savez(NPZ_CACHE_PATH, embeddings=embeddings, labels=labels)
+    print(f"✓ Cache écrit: {NPZ_CACHE_PATH}")
+
     return embeddings, labels
 
+def compute_cosine_centroids(embeddings, labels, unique_labels):
+    """Centroïdes L2-normalisés par classe.
+
+    La reconnaissance se réduit alors à « centroïde le plus proche en cosinus »:
+    une seule couche Dense sans biais, sans aucun entraînement.
+    """
+    emb = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    centroids = np.stack([emb[labels == name].mean(axis=0) for name in unique_labels])
+    centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    return centroids.astype(np.float32)
+
+def create_centroid_model(centroids):
+    """Modèle Keras à une couche dont les poids sont les centroïdes (pas de fit)"""
+    num_classes, input_dim = centroids.shape
+    model = keras.Sequential([
+        keras.layers.Input(shape=(input_dim,)),
+        keras.layers.Dense(num_classes, use_bias=False)
+    ])
+    model.layers[-1].set_weights([centroids.T])
+    print(f"✓ Modèle centroïdes créé: Dense({input_dim}→{num_classes}, sans biais)")
+    return model
+
 def create_classifier_model(input_dim, num_classes):
     """Crée un modèle de classification pour les embeddings"""
     print(f"\n🔨 Création du modèle classificateur...")
@@ -90,7 +128,9 @@ def train_model(model, X_train, y_train, X_val, y_val):
         epochs=100,
         batch_size=32,
         callbacks=[early_stopping],
-        verbose=1
+        # barre de progression seulement sur un terminal interactif;
+        # sinon une ligne par epoch (moins de contention stdout en CI)
+        verbose=1 if sys.stdout.isatty() else 2
     )
     
     # Évaluer le modèle
@@ -100,39 +140,44 @@ def train_model(model, X_train, y_train, X_val, y_val):
     
     return model
 
-def convert_to_tflite(model, output_path='android/app/src/main/assets'):
-    """Convertit le modèle en TensorFlow Lite avec compatibilité maximale"""
+def convert_to_tflite(model, X_train, output_path='android/app/src/main/assets'):
+    """Convertit le modèle en TensorFlow Lite avec quantification int8"""
     print(f"\n🔄 Conversion en TensorFlow Lite...")
-    
+
     os.makedirs(output_path, exist_ok=True)
-    
-    # Convertir en TFLite avec compatibilité stricte pour TFLite 2.16.1
+
     converter = tf.lite.TFLiteConverter.from_keras_model(model)
-    
-    # FORCER la compatibilité avec opérations de base uniquement
-    # Ne pas optimiser pour garder les opérations simples
-    # converter.optimizations = []  # PAS d'optimisation qui pourrait générer des ops v12
-    
-    # Utiliser uniquement les opérations de base TFLite
+
+    # Quantification int8 post-entraînement: modèle ~4x plus petit et inférence
+    # plus rapide sur ARM (MACs int8 NEON), calibrée sur les embeddings d'entraînement
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    def representative_dataset():
+        for i in range(min(200, len(X_train))):
+            yield [X_train[i:i+1].astype(np.float32)]
+
+    converter.representative_dataset = representative_dataset
     converter.target_spec.supported_ops = [
-        tf.lite.OpsSet.TFLITE_BUILTINS  # Opérations TFLite standards uniquement
+        tf.lite.OpsSet.TFLITE_BUILTINS_INT8
     ]
-    
-    # Désactiver les nouvelles fonctionnalités expérimentales
-    converter._experimental_lower_tensor_list_ops = False
-    
-    # Forcer l'utilisation de types de données standards
-    converter.inference_input_type = tf.float32
-    converter.inference_output_type = tf.float32
-    
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+
     try:
         tflite_model = converter.convert()
+        print("✓ Quantification int8 appliquée")
     except Exception as e:
-        print(f"⚠️ Erreur lors de la conversion standard: {e}")
-        print("🔄 Tentative avec quantification int8 pour compatibilité...")
-        
-        # Si la conversion échoue, essayer avec quantification
-        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        print(f"⚠️ Erreur lors de la quantification int8: {e}")
+        print("🔄 Repli sur la conversion float32 standard...")
+
+        # Repli: compatibilité stricte float32 (comportement historique)
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS  # Opérations TFLite standards uniquement
+        ]
+        converter._experimental_lower_tensor_list_ops = False
+        converter.inference_input_type = tf.float32
+        converter.inference_output_type = tf.float32
         tflite_model = converter.convert()
     
     # Sauvegarder
@@ -146,19 +191,19 @@ def convert_to_tflite(model, output_path='android/app/src/main/assets'):
     
     return tflite_path
 
-def save_metadata(labels, output_path='android/app/src/main/assets'):
-    """Sauvegarde les métadonnées (noms des classes)"""
+def save_metadata(unique_labels, output_path='android/app/src/main/assets', centroids=None):
+    """Sauvegarde les métadonnées (noms des classes, déjà uniques et triés)"""
     print(f"\n📝 Sauvegarde des métadonnées...")
-    
-    # Obtenir les noms uniques dans l'ordre
-    unique_labels = sorted(np.unique(labels))
-    
+
     metadata = {
         'names': list(unique_labels),
         'num_classes': len(unique_labels),
         'input_shape': [512],
-        'model_type': 'EmbeddingClassifier'
+        'model_type': 'CosineCentroid' if centroids is not None else 'EmbeddingClassifier'
     }
+    if centroids is not None:
+        # Copie des centroïdes côté client: permet un repli sans interpréteur TFLite
+        metadata['centroids'] = centroids.tolist()
     
     metadata_path = os.path.join(output_path, 'face_recognition_metadata.json')
     with open(metadata_path, 'w', encoding='utf-8') as f:
@@ -170,28 +215,50 @@ def save_metadata(labels, output_path='android/app/src/main/assets'):
     return metadata_path
 
 def main():
+    ap = argparse.ArgumentParser(description="Convertit face_model.pkl en modèle TensorFlow Lite")
+    ap.add_argument('--cosine-centroid', action='store_true',
+                    help='Saute tout entraînement: export des centroïdes cosinus par classe')
+    args = ap.parse_args()
+
     print("=" * 70)
     print("🤖 CONVERSION DE VOTRE MODÈLE POUR ANDROID")
     print("=" * 70)
-    
+
     pkl_path = 'face_model.pkl'
-    
+
     if not os.path.exists(pkl_path):
         print(f"❌ Erreur: {pkl_path} non trouvé")
         return
-    
+
     try:
         # 1. Charger les embeddings
         embeddings, labels = load_embeddings(pkl_path)
-        
+
+        # Un seul scan np.unique pour tout le script (affichage, rapport, métadonnées)
+        unique_labels, class_counts = np.unique(labels, return_counts=True)
+
+        if args.cosine_centroid:
+            # Pas d'entraînement: le « modèle » n'est que la matrice des centroïdes
+            centroids = compute_cosine_centroids(embeddings, labels, unique_labels)
+            model = create_centroid_model(centroids)
+            tflite_path = convert_to_tflite(model, embeddings)
+            metadata_path = save_metadata(unique_labels, centroids=centroids)
+            print("\n" + "=" * 70)
+            print("✅ CONVERSION RÉUSSIE!")
+            print("=" * 70)
+            print(f"📦 Fichiers créés:")
+            print(f"   ✓ {tflite_path}")
+            print(f"   ✓ {metadata_path}")
+            return
+
         # 2. Encoder les labels
         label_encoder = LabelEncoder()
         labels_encoded = label_encoder.fit_transform(labels)
         num_classes = len(label_encoder.classes_)
         
         print(f"\n📊 Classes encodées:")
-        for i, name in enumerate(label_encoder.classes_):
-            count = np.sum(labels == name)
+        # label_encoder.classes_ suit le même ordre trié que unique_labels
+        for i, (name, count) in enumerate(zip(unique_labels, class_counts)):
             print(f"   {i}: {name} ({count} exemples)")
         
         # 3. Diviser en train/val
@@ -211,10 +278,10 @@ def main():
         model = train_model(model, X_train, y_train, X_val, y_val)
         
         # 5. Convertir en TFLite
-        tflite_path = convert_to_tflite(model)
+        tflite_path = convert_to_tflite(model, X_train)
         
         # 6. Sauvegarder les métadonnées
-        metadata_path = save_metadata(labels)
+        metadata_path = save_metadata(unique_labels)
         
         print("\n" + "=" * 70)
         print("✅ CONVERSION RÉUSSIE!")
@@ -15,21 +15,85 @@ Usage:
   python download_mobilefacenet_onnx.py --output android/app/src/main/assets/mobilefacenet.onnx
 """
 import argparse
+import hashlib
 import os
+import shutil
 import sys
 import urllib.request
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-def download_from_url(url: str, output_path: str):
-    """Télécharge un fichier ONNX depuis une URL"""
+# Au-delà de ce seuil, et si le serveur accepte les requêtes Range, le
+# téléchargement est découpé en plages parallèles (sature le lien quand la
+# latence est élevée, ex: GitHub raw depuis une région lointaine)
+PARALLEL_THRESHOLD = 8 << 20
+RANGE_WORKERS = 8
+
+def _probe_range_support(url: str):
+    """HEAD: taille annoncée et support d'Accept-Ranges: bytes"""
+    try:
+        req = urllib.request.Request(url, method='HEAD')
+        with urllib.request.urlopen(req) as r:
+            size = int(r.headers.get('Content-Length') or 0)
+            ranges_ok = (r.headers.get('Accept-Ranges') or '').lower() == 'bytes'
+            return size, ranges_ok
+    except Exception:
+        return 0, False
+
+def _download_ranges(url: str, output_path: str, size: int):
+    """Téléchargement en RANGE_WORKERS plages HTTP parallèles, écrites à offset"""
+    span = -(-size // RANGE_WORKERS)  # plafond
+    spans = [(s, min(s + span, size) - 1) for s in range(0, size, span)]
+
+    with open(output_path, 'wb') as f:
+        f.truncate(size)
+
+    def fetch(bounds):
+        start, end = bounds
+        req = urllib.request.Request(url, headers={'Range': f'bytes={start}-{end}'})
+        # chaque worker écrit sa tranche disjointe: pas de verrou nécessaire
+        with urllib.request.urlopen(req) as r, open(output_path, 'r+b') as f:
+            f.seek(start)
+            shutil.copyfileobj(r, f, length=1 << 20)
+
+    with ThreadPoolExecutor(max_workers=RANGE_WORKERS) as ex:
+        list(ex.map(fetch, spans))
+
+def download_from_url(url: str, output_path: str, expected_sha256: str = None):
+    """Télécharge un fichier ONNX depuis une URL (en flux, par chunks de 1 Mio)
+
+    Si expected_sha256 est fourni, l'empreinte est vérifiée. Le hachage est
+    calculé au fil du flux (OpenSSL dispatche vers SHA-NI/ARMv8 Crypto quand
+    le CPU le supporte), donc la vérification est quasi gratuite.
+    """
     print(f"Téléchargement depuis: {url}")
     try:
-        with urllib.request.urlopen(url) as response:
-            data = response.read()
         os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
-        with open(output_path, 'wb') as f:
-            f.write(data)
-        print(f"✓ Téléchargé: {output_path} ({len(data)} bytes)")
+        # Flux chunk par chunk: la mémoire reste bornée à 1 Mio quel que soit
+        # la taille du modèle, et l'écriture disque recouvre la réception réseau
+        total = 0
+        h = hashlib.sha256()
+        size, ranges_ok = _probe_range_support(url)
+        if ranges_ok and size >= PARALLEL_THRESHOLD:
+            print(f"Téléchargement parallèle en {RANGE_WORKERS} plages ({size} bytes)")
+            _download_ranges(url, output_path, size)
+            total = size
+            with open(output_path, 'rb') as f:
+                while chunk := f.read(1 << 20):
+                    h.update(chunk)
+        else:
+            with urllib.request.urlopen(url) as response, open(output_path, 'wb') as f:
+                while chunk := response.read(1 << 20):
+                    f.write(chunk)
+                    h.update(chunk)
+                    total += len(chunk)
+        digest = h.hexdigest()
+        print(f"✓ Téléchargé: {output_path} ({total} bytes)")
+        print(f"  SHA-256: {digest}")
+        if expected_sha256 and digest != expected_sha256.lower():
+            print(f"✗ Empreinte SHA-256 inattendue (attendu: {expected_sha256})")
+            os.remove(output_path)
+            return False
         return True
     except Exception as e:
         print(f"✗ Erreur téléchargement: {e}")
@@ -70,11 +134,12 @@ def main():
     ap = argparse.ArgumentParser(description="Télécharge/convertit MobileFaceNet ONNX")
     ap.add_argument('--output', '-o', required=True, help='Chemin de sortie mobilefacenet.onnx')
     ap.add_argument('--url', help='URL du modèle ONNX pré-converti (optionnel)')
+    ap.add_argument('--expected-sha256', help='Empreinte SHA-256 attendue du fichier téléchargé')
     ap.add_argument('--tflite', help='Chemin TFLite à convertir (expérimental)')
     args = ap.parse_args()
 
     if args.url:
-        success = download_from_url(args.url, args.output)
+        success = download_from_url(args.url, args.output, expected_sha256=args.expected_sha256)
     elif args.tflite:
         success = convert_tflite_to_onnx(args.tflite, args.output)
     else:
@@ -93,7 +158,10 @@ def main():
         print("   - torch.onnx.export(model, dummy_input, 'mobilefacenet.onnx')")
         print()
         print("3. Convertir depuis TensorFlow:")
-        print("   - python -m tf2onnx.convert --saved-model ./model --output mobilefacenet.onnx")
+        print("   - python -m tf2onnx.convert --saved-model ./model --output mobilefacenet.onnx \\")
+        print("       --inputs-as-nchw input_1:0")
+        print("   (--inputs-as-nchw supprime les paires de Transpose autour de chaque Conv:")
+        print("    TF est NHWC, ONNX Runtime préfère NCHW)")
         print()
         print("4. Utiliser modèle pré-entraîné disponible:")
         print("   - Insightface (ArcFace/MobileFaceNet)")
@@ -103,6 +171,7 @@ def main():
         print("SPÉCIFICATIONS REQUISES:")
         print("=" * 70)
         print("  Entrée:  [1, 112, 112, 3] float32 NHWC normalisé (x-127.5)/127.5")
+        print("           (export ONNX recommandé en NCHW: [1, 3, 112, 112], cf. option ci-dessus)")
         print("  Sortie:  [1, 512] float32 (embedding)")
         print()
         print("Exemple commande avec URL:")